@@ -1,39 +1,56 @@
 import abc
+import concurrent.futures
+import copy
 import dataclasses
+import errno
+import glob
 import json
 import os
-import platform
+import re
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 from datetime import timedelta
 
-import eyed3
-import yt_dlp
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
 
 #################
 ### CONSTANTS ###
 #################
-PLATFORM = platform.platform()
 MISC_ARTIST_NAME = "Other"
 TMP_DOWNLOAD_DIR = "downloads"
 AUDIO_FORMAT = "mp3"
 IGNORE_DISKS = {"Macintosh HD"}
 MAC_VOLUMES_DIR = "/Volumes"
 LINUX_MOUNT_DIR = "/mnt"
+LINUX_DEV_DIR = "/dev"
+LINUX_MOUNTS_FILE = "/proc/mounts"
+# /proc/mounts writes space, tab, newline and backslash as \ooo octal escapes.
+MOUNTS_ESCAPE_PATTERN = re.compile(r"\\([0-7]{3})")
+# Lists whole disks and partitions only, unlike the thousands of nodes in /dev.
+LINUX_BLOCK_DIR = "/sys/class/block"
 LOCAL_EXPORT_DIR = os.environ.get("MPME_LOCAL_EXPORT_DIR")
 RETRY_ATTEMPTS = 3
-MAC_PLATFORM_PART = "macOS"
-LINUX_PLATFORM_PART = "Linux"
 SONG_DELIM_CHAR = "~"
 RESET_DOWNLOADS_EACH_RUN = True
 DEBUG = False
 TITLE_SHORT_CHARS = {"m", "s", "t"}
+TITLE_SHORT_PATTERN = re.compile(f"'([{''.join(TITLE_SHORT_CHARS).upper()}])")
 TAGGING_ENABLED = True
 OFFER_EXPORT_FEATURES = True
 UNSUPPORTED_OS_MSG = "Windows - not sure"
 BIG_FILE_MB = 30
+FETCH_JOBS_ENV = os.environ.get("MPME_FETCH_JOBS", "")
+# Falls back to 8 unless MPME_FETCH_JOBS is a positive integer.
+FETCH_JOBS = (FETCH_JOBS_ENV.isdecimal() and int(FETCH_JOBS_ENV)) or 8
+COPY_JOBS = 4
+DISK_WATCH_TIMEOUT_SECONDS = 5
 
 ###############
 ### HELPERS ###
@@ -41,10 +58,9 @@ BIG_FILE_MB = 30
 
 
 def format_title(string):
-    string = string.strip().title()
-    for char in TITLE_SHORT_CHARS:
-        string = string.replace(f"'{char.upper()}", f"'{char}")
-    return string
+    return TITLE_SHORT_PATTERN.sub(
+        lambda match: match.group(0).lower(), string.strip().title()
+    )
 
 
 class YTDLogger:
@@ -67,14 +83,95 @@ def mprint(message):
     print(f"\n{message}\n")
 
 
+def remove_tree(path):
+    """rm -rf deletes a large tree faster than shutil.rmtree walking it in Python."""
+    if sys.platform == "win32":
+        shutil.rmtree(path)
+    else:
+        subprocess.run(["rm", "-rf", path], check=True)
+
+
+def remove_old_downloads():
+    """Also catches folders left behind by a run that exited mid-delete."""
+    for old_dir in glob.glob(f"{TMP_DOWNLOAD_DIR}.old.*"):
+        remove_tree(old_dir)
+
+
 def prepare():
     print("Clearing downloads...")
     if os.path.exists(TMP_DOWNLOAD_DIR):
         if RESET_DOWNLOADS_EACH_RUN:
-            shutil.rmtree(TMP_DOWNLOAD_DIR)
+            # Renaming is instant; the old files are deleted in the background.
+            old_dir = tempfile.mkdtemp(prefix=f"{TMP_DOWNLOAD_DIR}.old.", dir=".")
+            os.rename(TMP_DOWNLOAD_DIR, os.path.join(old_dir, TMP_DOWNLOAD_DIR))
             os.mkdir(TMP_DOWNLOAD_DIR)
     else:
         os.mkdir(TMP_DOWNLOAD_DIR)
+    threading.Thread(target=remove_old_downloads).start()
+
+
+def walk_files(src, dst):
+    """Yield (source, target) file pairs under src, creating the folders in dst."""
+    os.makedirs(dst, exist_ok=True)
+    with os.scandir(src) as entries:
+        for entry in entries:
+            target = os.path.join(dst, entry.name)
+            if entry.is_dir():
+                yield from walk_files(entry.path, target)
+            else:
+                yield entry.path, target
+
+
+def drop_from_page_cache(path, flush=False):
+    """Linux never drops dirty pages, so a freshly written file needs flush=True."""
+    fd = os.open(path, os.O_RDWR if flush else os.O_RDONLY)
+    try:
+        if flush:
+            os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def copy_file(source, target):
+    shutil.copyfile(source, target)
+    if hasattr(os, "posix_fadvise"):
+        # Exported songs are not read again, so keep them out of the page cache.
+        drop_from_page_cache(source)
+        drop_from_page_cache(target, flush=True)
+
+
+def copy_tree(src, dst):
+    """Copy every file under src into dst, a few files at a time."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=COPY_JOBS) as executor:
+        futures = [
+            executor.submit(copy_file, source, target)
+            for source, target in walk_files(src, dst)
+        ]
+    for future in futures:
+        future.result()
+
+
+def link_tree(src, dst):
+    """Hard link every file under src into dst, which must be on the same disk."""
+    for source, target in walk_files(src, dst):
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError as error:
+            # e.g. FAT-formatted disks, which have no hard links.
+            if error.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP):
+                raise
+            copy_file(source, target)
+
+
+def export_tree(src, dst):
+    """Hard link src into dst when both are on the same filesystem, else copy."""
+    if os.stat(src).st_dev == os.stat(dst).st_dev:
+        link_tree(src, dst)
+    else:
+        copy_tree(src, dst)
 
 
 YDL_BASE_OPTS = {
@@ -92,43 +189,47 @@ YDL_BASE_OPTS = {
 }
 
 
-@dataclasses.dataclass
+def prewarm():
+    """Load yt_dlp and its extractors while the user is still answering prompts."""
+    import yt_dlp
+
+    yt_dlp.YoutubeDL(copy.deepcopy(YDL_BASE_OPTS)).close()
+
+
+@dataclasses.dataclass(slots=True)
 class Song:
     yid: str | None
     name: str
     artist: str
+    search_term: str = dataclasses.field(init=False, repr=False, compare=False)
+    full_name: str = dataclasses.field(init=False, repr=False, compare=False)
+    file_name: str = dataclasses.field(init=False, repr=False, compare=False)
+    full_path: str = dataclasses.field(init=False, repr=False, compare=False)
+    _size_mb: float | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
 
-    @property
-    def search_term(self):
+    def __post_init__(self):
         if self.yid:
-          return self.yid
-        return (
-            f"{self.name} {self.artist}"
-            if self.artist != MISC_ARTIST_NAME
-            else self.name
-        )
-
-    @property
-    def full_name(self):
-        return (
+            self.search_term = self.yid
+        elif self.artist != MISC_ARTIST_NAME:
+            self.search_term = f"{self.name} {self.artist}"
+        else:
+            self.search_term = self.name
+        self.full_name = (
             f"{format_title(self.name)} {SONG_DELIM_CHAR} {format_title(self.artist)}"
         )
-
-    @property
-    def file_name(self):
-        return f"{self.full_name}.{AUDIO_FORMAT}"
-
-    @property
-    def full_path(self):
-        return os.path.join(TMP_DOWNLOAD_DIR, self.file_name)
+        self.file_name = f"{self.full_name}.{AUDIO_FORMAT}"
+        self.full_path = os.path.join(TMP_DOWNLOAD_DIR, self.file_name)
 
     @property
     def size_mb(self):
-        try:
-          file_stats = os.stat(self.full_path)
-          return file_stats.st_size / (1204 * 1204)
-        except:
-          return -1
+        if self._size_mb is None:
+            try:
+                self._size_mb = os.stat(self.full_path).st_size / (1024 * 1024)
+            except OSError:
+                return -1
+        return self._size_mb
 
     @classmethod
     def from_string(cls, string):
@@ -141,24 +242,45 @@ class Song:
           case _:
             raise Exception(f"Failed to parse: {string}.")
 
+    @classmethod
+    def from_file(cls, path):
+        """Reads the song back from an exported mp3's ID3 tag."""
+        import eyed3.id3
+
+        # Parses only the tag, skipping the audio frame scan eyed3.load does.
+        tag = eyed3.id3.Tag()
+        if not tag.parse(path) or not tag.title:
+            name = os.path.splitext(os.path.basename(path))[0]
+            return cls(yid=None, name=name, artist=MISC_ARTIST_NAME)
+        return cls(yid=None, name=tag.title, artist=tag.artist or MISC_ARTIST_NAME)
+
+    @classmethod
+    def from_lines(cls, lines):
+        return (cls.from_string(line.rstrip("\n")) for line in lines if line.strip())
+
+    def to_string(self):
+        """The inverse of from_string, used to sort songs as their source lines."""
+        return SONG_DELIM_CHAR.join(filter(None, (self.yid, self.name, self.artist)))
+
     def __str__(self):
         return self.full_name
 
-    def tag(self):
-        eyed3_file = eyed3.load(self.full_path)
-        eyed3_file.tag.artist = self.artist
-        eyed3_file.tag.title = self.name
-        eyed3_file.tag.save()
-
-    def fetch(self):
+    def fetch(self, ydl):
         path = os.path.join(TMP_DOWNLOAD_DIR, self.full_name)
-        for attempt in range(RETRY_ATTEMPTS):
-            ydl_opts = YDL_BASE_OPTS | {
-                "outtmpl": f"{path}.%(ext)s",
+        ydl.params["outtmpl"]["default"] = f"{path}.%(ext)s"
+        if TAGGING_ENABLED:
+            # Tag during the mp3 conversion instead of rewriting the file after.
+            ydl.params["postprocessor_args"] = {
+                "extractaudio": [
+                    "-metadata",
+                    f"artist={self.artist}",
+                    "-metadata",
+                    f"title={self.name}",
+                ]
             }
+        for attempt in range(RETRY_ATTEMPTS):
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    result = ydl.download([f"ytsearch:{self.search_term}"])
+                ydl.download([f"ytsearch:{self.search_term}"])
                 return True
             except Exception as error:
                 mprint(f"Issue: {error}")
@@ -172,6 +294,9 @@ class SongList:
         self.songs = []
         self.fetch_songs_failed = []
         self.fetch_songs_big = []
+        self.ydl_per_thread = threading.local()
+        self.ydl_instances = []
+        self.ydl_instances_lock = threading.Lock()
 
     def __str__(self):
         return "\n".join(str(song) for song in self.songs)
@@ -190,11 +315,10 @@ class SongList:
         while True:
             choice = input(f"Please choose an option: {display_choices}\n:")
             try:
-                self.songs = [
-                    Song.from_string(line)
-                    for line in sorted(options[int(choice) - 1][1]())
-                    if line.strip()
-                ]
+                self.songs = sorted(
+                    options[int(choice) - 1][1](),
+                    key=Song.to_string,
+                )
                 break
             except (IndexError, ValueError):
                 pass
@@ -202,17 +326,16 @@ class SongList:
     def populate_from_file(self):
         """Excepts a linear list of Title~Artist"""
         with open(input("Enter file name path: ")) as data:
-            return data.read().split("\n")
+            yield from Song.from_lines(data)
 
     def populate_from_json(self):
         """Expects a JSON object of "Artist": ["Title 1", ...]"""
-        rows = []
         with open(input("Enter file name path: ")) as data:
-            data = json.load(data)
-            for artist, titles in data.items():
-                for title in titles:
-                    rows.append(f"{title}{SONG_DELIM_CHAR}{artist}")
-            return rows
+            return [
+                Song(yid=None, name=title, artist=artist)
+                for artist, titles in json.load(data).items()
+                for title in titles
+            ]
 
     def populate_from_url(self):
         raise Exception("Not implemented!")
@@ -221,7 +344,28 @@ class SongList:
         mprint(
             "Paste a list of '<song>~<artist>' lines (Use ENTER then ctrl D when done): "
         )
-        return sys.stdin.readlines()
+        return Song.from_lines(sys.stdin)
+
+    def get_ydl(self):
+        """One YoutubeDL per download thread, reused for every song it fetches."""
+        ydl = getattr(self.ydl_per_thread, "ydl", None)
+        if ydl is None:
+            import yt_dlp
+
+            # YoutubeDL keeps the dict it is given, and fetch mutates it per song.
+            ydl = yt_dlp.YoutubeDL(copy.deepcopy(YDL_BASE_OPTS))
+            self.ydl_per_thread.ydl = ydl
+            with self.ydl_instances_lock:
+                self.ydl_instances.append(ydl)
+        return ydl
+
+    def fetch_song(self, song):
+        return song.fetch(self.get_ydl())
+
+    def close_ydls(self):
+        for ydl in self.ydl_instances:
+            ydl.close()
+        self.ydl_instances = []
 
     def show_big(self):
         if self.fetch_songs_big:
@@ -237,43 +381,141 @@ class SongList:
                 print(song.full_name)
             print()
 
+    def ask_jobs(self):
+        while True:
+            try:
+                jobs = int(input(f"Parallel downloads [{FETCH_JOBS}]: ") or FETCH_JOBS)
+                if jobs > 0:
+                    return jobs
+            except ValueError:
+                pass
+
     def fetch_all(self):
         self.fetch_songs_failed = []
         start = int(input("Start at index [0]: ") or 0)
+        jobs = self.ask_jobs()
         total = len(self.songs)
-        average_download_seconds = 0
-        total_download_seconds = 0
-        eta_seconds = 0
-        for i, song in enumerate(self.songs[start:]):
-            real_index = i + start + 1
-            eta_display = (
-                "eta {}".format(str(timedelta(seconds=eta_seconds)))[:11]
-                if eta_seconds
-                else "eta N/A"
-            )
-            mprint(f"[{real_index}/{total} " f"({eta_display})] Fetching {song}...")
-
-            start_time = time.time()
-
-            if song.fetch() and TAGGING_ENABLED:
-                song.tag()
-            else:
-                self.fetch_songs_failed.append(song)
-            if song.size_mb > BIG_FILE_MB:
-              self.fetch_songs_big.append(song)
-
-            end_time = time.time()
-
-            duration_seconds = end_time - start_time
-            total_download_seconds += duration_seconds
-            average_download_seconds = round(total_download_seconds / (i + 1), 2)
-            eta_seconds = average_download_seconds * (total - (real_index))
+        # Duplicates would download concurrently to the same file.
+        pending = {}
+        for song in self.songs[start:]:
+            if not os.path.exists(song.full_path):
+                pending.setdefault(song.full_path, song)
+        songs = list(pending.values())
+        done = total - len(songs)
+        if done > start:
+            mprint(f"Skipping {done - start} already downloaded or duplicate songs.")
+        start_time = time.time()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            futures = {executor.submit(self.fetch_song, song): song for song in songs}
+            # Bookkeeping stays on this thread as downloads finish.
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                song = futures[future]
+                real_index = i + done + 1
+
+                fetched = future.result()
+                if not fetched:
+                    self.fetch_songs_failed.append(song)
+                if song.size_mb > BIG_FILE_MB:
+                    self.fetch_songs_big.append(song)
+
+                average_download_seconds = (time.time() - start_time) / (i + 1)
+                eta_seconds = round(average_download_seconds * (total - real_index))
+                eta_display = (
+                    "eta {}".format(str(timedelta(seconds=eta_seconds)))[:11]
+                    if eta_seconds
+                    else "eta N/A"
+                )
+                status = "Fetched" if fetched else "Failed"
+                mprint(f"[{real_index}/{total} " f"({eta_display})] {status} {song}")
+        except BaseException:
+            # Ctrl-C or an error: don't start any of the queued downloads.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown()
+            self.close_ydls()
 
         mprint("Done!")
         self.show_failed()
         self.show_big()
 
 
+def list_linux_disks():
+    with os.scandir(LINUX_BLOCK_DIR) as entries:
+        return [entry.name for entry in entries if entry.name.startswith("sd")]
+
+
+def list_mac_disks():
+    with os.scandir(MAC_VOLUMES_DIR) as entries:
+        return [entry.name for entry in entries]
+
+
+def find_mount_point(device):
+    """Where device is already mounted (e.g. by the desktop), if anywhere."""
+    with open(LINUX_MOUNTS_FILE) as mounts:
+        for line in mounts:
+            source, mount_point = line.split()[:2]
+            if source == device:
+                return MOUNTS_ESCAPE_PATTERN.sub(
+                    lambda match: chr(int(match.group(1), 8)), mount_point
+                )
+    return None
+
+
+def mount_linux_disk(disk_name):
+    device = os.path.join(LINUX_DEV_DIR, disk_name)
+    path = find_mount_point(device)
+    if path is None:
+        subprocess.check_call(["mount", device, LINUX_MOUNT_DIR])
+        path = LINUX_MOUNT_DIR
+    return path
+
+
+def mount_mac_disk(disk_name):
+    return os.path.join(MAC_VOLUMES_DIR, disk_name)
+
+
+DISK_LISTERS = {"linux": list_linux_disks, "darwin": list_mac_disks}
+DISK_MOUNTERS = {"linux": mount_linux_disk, "darwin": mount_mac_disk}
+# sysfs does not emit inotify events, so new disks are watched for in /dev.
+DISK_WATCH_DIRS = {"linux": LINUX_DEV_DIR, "darwin": MAC_VOLUMES_DIR}
+
+
+class DiskWatcher:
+    """Wakes up when a new disk may have appeared, or every second without watchdog.
+
+    With watchdog, it still re-checks every DISK_WATCH_TIMEOUT_SECONDS in case an
+    event was missed.
+    """
+
+    def __init__(self):
+        self.changed = threading.Event()
+        self.observer = None
+
+    def __enter__(self):
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(self, DISK_WATCH_DIRS[sys.platform])
+            self.observer.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def dispatch(self, event):
+        self.changed.set()
+
+    def wait(self):
+        if self.observer is None:
+            time.sleep(1)
+        else:
+            self.changed.wait(DISK_WATCH_TIMEOUT_SECONDS)
+            self.changed.clear()
+
+
 class Exporter(abc.ABC):
     @abc.abstractmethod
     def export(self):
@@ -285,39 +527,38 @@ class ExternalDiskExporter(Exporter):
     name = "MP3 Player (external disk)"
 
     def export(self):
-        disk_name = self.find_disks()
-        if LINUX_PLATFORM_PART in PLATFORM:
-            subprocess.check_call(["mount", f"/dev/{disk_name}", LINUX_MOUNT_DIR])
-            path = LINUX_MOUNT_DIR
-        elif MAC_PLATFORM_PART in PLATFORM:
-            path = os.path.join(MAC_VOLUMES_DIR, disk_name)
-        else:
-            raise Exception(UNSUPPORTED_OS_MSG)
+        path = DISK_MOUNTERS[sys.platform](self.find_disks())
         print("Exporting songs to disk...")
-        shutil.copytree(TMP_DOWNLOAD_DIR, path, dirs_exist_ok=True)
+        export_tree(TMP_DOWNLOAD_DIR, path)
 
     def find_disks(self):
+        list_disks = DISK_LISTERS.get(sys.platform)
+        if list_disks is None:
+            raise Exception(UNSUPPORTED_OS_MSG)
         mprint("Searching for disks...")
         while True:
-            if LINUX_PLATFORM_PART in PLATFORM:
-                available_disks = {disk for disk in os.listdir("/dev") if "sd" in disk}
-            elif MAC_PLATFORM_PART in PLATFORM:
-                available_disks = set(os.listdir(MAC_VOLUMES_DIR))
-            else:
-                raise Exception(UNSUPPORTED_OS_MSG)
-            available_disks = list(available_disks - IGNORE_DISKS)
-            if not available_disks:
-                time.sleep(1)
-                continue
-            display_disks = "\n".join(
-                f"({index + 1}) {disk}" for index, disk in enumerate(available_disks)
-            )
             try:
-                choice = input(f"Which disk?\n {display_disks}\n:")
-                return available_disks[int(choice) - 1]
+                return self.choose_disk(self.wait_for_disks(list_disks))
             except (IndexError, ValueError):
                 pass
 
+    def wait_for_disks(self, list_disks):
+        with DiskWatcher() as watcher:
+            while True:
+                available_disks = [
+                    disk for disk in list_disks() if disk not in IGNORE_DISKS
+                ]
+                if available_disks:
+                    return available_disks
+                watcher.wait()
+
+    def choose_disk(self, available_disks):
+        display_disks = "\n".join(
+            f"({index + 1}) {disk}" for index, disk in enumerate(available_disks)
+        )
+        choice = input(f"Which disk?\n {display_disks}\n:")
+        return available_disks[int(choice) - 1]
+
 
 class LocalExporter(Exporter):
 
@@ -330,12 +571,7 @@ class LocalExporter(Exporter):
         if not os.path.exists(LOCAL_EXPORT_DIR):
             print("Folder does not exist. Creating.")
             os.mkdir(LOCAL_EXPORT_DIR)
-        try:
-          shutil.copytree(TMP_DOWNLOAD_DIR, LOCAL_EXPORT_DIR, dirs_exist_ok=True)
-        except shutil.Error:
-          # Apparently it's okay...
-          # https://stackoverflow.com/questions/36564646/why-python-shutil-copytree-is-working-but-it-has-error
-          pass
+        export_tree(TMP_DOWNLOAD_DIR, LOCAL_EXPORT_DIR)
 
 
 class GoogleDriveExporter(Exporter):
@@ -376,6 +612,7 @@ Scan, download and export music to an external source.
 
 
 def main():
+    threading.Thread(target=prewarm, daemon=True).start()
     show_introduction()
     prepare()
 
@@ -1,33 +1,40 @@
+import concurrent.futures
 import dataclasses
+import heapq
 import mpme
 import os
+import sys
+from collections import defaultdict
 
 
 DISPLAY_ARTIST_COUNT = 50
+LOAD_JOBS = 16
 
 
 def load_songs():
   disk_name = mpme.ExternalDiskExporter().find_disks()
-  path = os.path.join(mpme.VOLUMES_DIR, disk_name)
-  return [
-    mpme.Song.from_file(os.path.join(path, song))
-    for song in os.listdir(path)
-    if song.endswith(mpme.AUDIO_FORMAT)
-  ]
+  path = mpme.DISK_MOUNTERS[sys.platform](disk_name)
+  with os.scandir(path) as entries:
+    paths = [
+      entry.path
+      for entry in entries
+      if entry.is_file() and entry.name.endswith(mpme.AUDIO_FORMAT)
+    ]
+  # Tag reads are small and slow over USB, so overlap them.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=LOAD_JOBS) as executor:
+    return list(executor.map(mpme.Song.from_file, paths))
 
 def get_stats(songs):
   print(f'\nTotal: {len(songs)} \n')
-  artist_song_map = {}
+  artist_song_map = defaultdict(list)
   for song in songs:
-    if song.artist not in artist_song_map:
-      artist_song_map[song.artist] = []
     artist_song_map[song.artist].append(song.name)
 
-  sorted_data = sorted(
+  top_artists = heapq.nlargest(
+    DISPLAY_ARTIST_COUNT,
     artist_song_map.items(),
-    key=lambda item: len(item[1]),
-    reverse=True)
-  for artist, songs in sorted_data[:DISPLAY_ARTIST_COUNT]:
+    key=lambda item: len(item[1]))
+  for artist, songs in top_artists:
     print(f'{artist}: {len(songs)} songs')
 
 def main():